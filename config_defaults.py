@@ -30,6 +30,18 @@ DEFAULT_NEXTCLOUD_SHARE_LABEL: str | None = None
 DEFAULT_NEXTCLOUD_PUBLIC_UPLOAD = False
 DEFAULT_NEXTCLOUD_PERMISSIONS = 1
 DEFAULT_BLACKLISTED_DOMAINS = ""
+DEFAULT_TELEGRAM_CUSTOM_API_URL: str | None = None
+DEFAULT_TELEGRAM_UPLOAD_LIMIT: int | None = None  # None -> 50 MB, or 2000 MB with a custom API server
+DEFAULT_UPLOAD_WORKERS = 4
+DEFAULT_LOGS_BATCH_INTERVAL = 5  # seconds
+DEFAULT_LOGS_QUEUE_SIZE = 1000
+DEFAULT_LOGS_JSONL_PATH: str | None = None
+DEFAULT_SMALL_FILE_MAX_BYTES = 20 * 1024 * 1024  # 0 disables the in-memory fast path
+DEFAULT_MEMORY_CAP_BYTES = 128 * 1024 * 1024
+DEFAULT_MEMORY_DIR = "/dev/shm"
+DEFAULT_TRACE_DIR: str | None = None
+DEFAULT_STARTUP_PROFILE = False
+DEFAULT_TRACE_FORMAT = "jsonl"  # or "chrome"
 
 def _env_int(var_name: str, default: int | None = None) -> int | None:
     raw = os.getenv(var_name)
@@ -57,6 +69,9 @@ def _env_list(var_name: str) -> list[str]:
 
 token = os.getenv("BOT_TOKEN") or DEFAULT_TOKEN
 logs = _env_int("BOT_LOGS_CHAT_ID", DEFAULT_LOGS_CHAT_ID)
+logs_batch_interval = _env_int("BOT_LOGS_BATCH_INTERVAL", DEFAULT_LOGS_BATCH_INTERVAL) or DEFAULT_LOGS_BATCH_INTERVAL
+logs_queue_size = _env_int("BOT_LOGS_QUEUE_SIZE", DEFAULT_LOGS_QUEUE_SIZE) or DEFAULT_LOGS_QUEUE_SIZE
+logs_jsonl_path = os.getenv("BOT_LOGS_JSONL_PATH") or DEFAULT_LOGS_JSONL_PATH
 max_filesize = _env_int("BOT_MAX_FILESIZE", DEFAULT_MAX_FILESIZE) or DEFAULT_MAX_FILESIZE
 output_folder = os.getenv("BOT_OUTPUT_FOLDER", DEFAULT_OUTPUT_FOLDER)
 deno_path = os.getenv("BOT_DENO_PATH", DEFAULT_DENO_PATH)
@@ -89,6 +104,16 @@ if not remote_components_list and DEFAULT_REMOTE_COMPONENTS:
     remote_components_list = DEFAULT_REMOTE_COMPONENTS
 remote_components = remote_components_list or None
 
+telegram_upload_limit = _env_int("BOT_TELEGRAM_UPLOAD_LIMIT", DEFAULT_TELEGRAM_UPLOAD_LIMIT)
+upload_workers = _env_int("BOT_UPLOAD_WORKERS", DEFAULT_UPLOAD_WORKERS) or DEFAULT_UPLOAD_WORKERS
+small_file_max_bytes = _env_int("BOT_SMALL_FILE_MAX_BYTES", DEFAULT_SMALL_FILE_MAX_BYTES)
+memory_cap_bytes = _env_int("BOT_MEMORY_CAP_BYTES", DEFAULT_MEMORY_CAP_BYTES)
+memory_dir = os.getenv("BOT_MEMORY_DIR") or DEFAULT_MEMORY_DIR
+
+trace_dir = os.getenv("BOT_TRACE_DIR") or DEFAULT_TRACE_DIR
+trace_format = os.getenv("BOT_TRACE_FORMAT") or DEFAULT_TRACE_FORMAT
+startup_profile = _env_bool("BOT_STARTUP_PROFILE", DEFAULT_STARTUP_PROFILE)
+
 yt_dlp_verbose = _env_bool("BOT_YTDLP_VERBOSE", DEFAULT_YT_DLP_VERBOSE)
 
 admin_id_values = _env_list("BOT_ADMIN_IDS")
@@ -105,3 +130,6 @@ for value in admin_id_values:
 
 # Added default and environment variable support for blacklisted domains
 blacklisted_domains = os.getenv("BOT_BLACKLISTED_DOMAINS", DEFAULT_BLACKLISTED_DOMAINS)
+
+# Local Bot API server, e.g. http://api-server:8081/bot{0}/{1}; also raises the upload limit to 2000 MB
+telegram_custom_api_url = os.getenv("BOT_CUSTOM_TELEGRAM_API_URL") or DEFAULT_TELEGRAM_CUSTOM_API_URL
@@ -5,6 +5,9 @@ Copy these values to your environment (or a .env file loaded before running the
 
 BOT_TOKEN=123456:ABC...
 BOT_LOGS_CHAT_ID=2390049
+BOT_LOGS_BATCH_INTERVAL=5
+BOT_LOGS_QUEUE_SIZE=1000
+BOT_LOGS_JSONL_PATH=downloads/requests.jsonl
 BOT_MAX_FILESIZE=50000000
 BOT_OUTPUT_FOLDER=downloads
 BOT_DENO_PATH=C:\\Users\\you\\scoop\\apps\\nodejs-lts\\current\\bin\\deno
@@ -13,6 +16,14 @@ BOT_ADMIN_IDS=123456789,987654321
 BOT_JS_RUNTIMES={"deno":{"executable":"C:/Users/you/.deno/bin/deno.exe"}}
 BOT_REMOTE_COMPONENTS=ejs:github
 BOT_YTDLP_VERBOSE=1
+BOT_TELEGRAM_UPLOAD_LIMIT=52428800
+BOT_UPLOAD_WORKERS=4
+BOT_SMALL_FILE_MAX_BYTES=20971520
+BOT_MEMORY_CAP_BYTES=134217728
+BOT_MEMORY_DIR=/dev/shm
+BOT_TRACE_DIR=downloads/traces
+BOT_TRACE_FORMAT=chrome
+BOT_STARTUP_PROFILE=0
 BOT_NETRC=0
 BOT_NETRC_PATH=C:\\Users\\you\\.netrc
 BOT_NETRC_CMD=gpg --decrypt C:/Users/you/.authinfo.gpg
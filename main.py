@@ -1,8 +1,27 @@
+import time
+STARTED_AT = time.perf_counter()  # first thing, so the startup report covers module imports
 from urllib.parse import urlparse, quote, urlencode
 import datetime
 from typing import Any, Optional, cast
 from pathlib import Path
 import subprocess
+import glob
+import csv
+import errno
+import json
+import queue
+import threading
+import atexit
+import signal
+import io
+import sys
+import cProfile
+import pstats
+import tracemalloc
+import shutil
+import tempfile
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 import telebot
 try:
     import config  # type: ignore
@@ -13,13 +32,10 @@ if not getattr(config, 'token', None):
     raise ValueError("BOT_TOKEN is required. Set BOT_TOKEN env var or supply config.py.")
 
 BOT_TOKEN = cast(str, config.token)
-import yt_dlp
-from yt_dlp.utils import DownloadError
 import re
 from telebot.util import quick_markup
 from telebot.apihelper import ApiTelegramException
 from telebot import apihelper
-import time
 import requests
 
 
@@ -38,6 +54,26 @@ NEXTCLOUD_TIMEOUT = 30  # seconds
 YTDLP_RETRIES = getattr(config, 'yt_dlp_retries', 10)
 YTDLP_FRAGMENT_RETRIES = getattr(config, 'yt_dlp_fragment_retries', 25)
 YTDLP_HTTP_CHUNK_SIZE = getattr(config, 'yt_dlp_http_chunk_size', 5 * 1024 * 1024)
+SPLIT_SAFETY_FACTOR = 0.9  # aim below the limit, keyframe cuts overshoot the target
+SPLIT_MAX_ATTEMPTS = 4
+UPLOAD_WORKERS = max(1, int(getattr(config, 'upload_workers', 4) or 1))
+UPLOAD_ATTEMPTS = 5  # per part, only 429 flood-limit responses are retried
+LOG_BATCH_INTERVAL = float(getattr(config, 'logs_batch_interval', 5) or 5)  # seconds
+LOG_QUEUE_SIZE = int(getattr(config, 'logs_queue_size', 1000) or 1000)
+LOG_JSONL_PATH = getattr(config, 'logs_jsonl_path', None)
+TELEGRAM_MESSAGE_LIMIT = 4096
+LOG_SEND_ATTEMPTS = 3
+TRACE_DIR = Path(config.trace_dir) if getattr(config, 'trace_dir', None) else None
+TRACE_FORMAT = (getattr(config, 'trace_format', None) or 'jsonl').lower()  # 'jsonl' or 'chrome'
+PROGRESS_TRACE_INTERVAL = 1  # seconds between recorded yt-dlp progress events
+PROFILE_REPORT_LINES = 30
+PROFILE_TRACEMALLOC_FRAMES = 10
+STARTUP_PROFILE = bool(getattr(config, 'startup_profile', False))
+STARTUP_IMPORTTIME_TOP = 15
+SMALL_FILE_MAX_BYTES = int(getattr(config, 'small_file_max_bytes', 20 * 1024 * 1024) or 0)  # 0 disables the fast path
+MEMORY_CAP_BYTES = int(getattr(config, 'memory_cap_bytes', 128 * 1024 * 1024) or 0)
+MEMORY_DIR = Path(getattr(config, 'memory_dir', None) or '/dev/shm')
+MEMORY_RESERVE_FACTOR = 2  # downloaded file + ffmpeg output live side by side
 ADMIN_IDS = {
     int(user_id)
     for user_id in getattr(config, 'admin_ids', [])
@@ -54,6 +90,87 @@ TELEGRAM_CUSTOM_API_URL = getattr(config, 'telegram_custom_api_url', None)
 CUSTOM_TELEGRAM_API_URL = getattr(config, 'telegram_custom_api_url', None)
 if TELEGRAM_CUSTOM_API_URL:
     apihelper.API_URL = TELEGRAM_CUSTOM_API_URL.strip()
+# The public Bot API caps uploads at 50 MB, a local Bot API server at 2000 MB
+TELEGRAM_UPLOAD_LIMIT = int(
+    getattr(config, 'telegram_upload_limit', None)
+    or (2000 * 1024 * 1024 if TELEGRAM_CUSTOM_API_URL else 50 * 1024 * 1024)
+)
+
+# yt-dlp pulls in hundreds of extractor modules, so it is imported lazily and
+# warmed up in the background once polling has started
+_yt_dlp_lock = threading.Lock()
+_yt_dlp_module: Any = None
+startup_timings: dict[str, float] = {'module_loaded': time.perf_counter() - STARTED_AT}
+
+
+def load_yt_dlp():
+    """Import yt_dlp and its extractor registry once; concurrent callers wait for the first."""
+    global _yt_dlp_module
+    with _yt_dlp_lock:
+        if _yt_dlp_module is None:
+            started = time.perf_counter()
+            import yt_dlp
+            import yt_dlp.utils
+            from yt_dlp.extractor import gen_extractor_classes
+            gen_extractor_classes()
+            _yt_dlp_module = yt_dlp
+            startup_timings['yt_dlp_load'] = time.perf_counter() - started
+        return _yt_dlp_module
+
+
+def warm_up_yt_dlp() -> None:
+    try:
+        load_yt_dlp()
+    except Exception as exc:
+        print(f"[startup] yt-dlp warm-up failed ({exc})")
+        return
+    print(f"[startup] yt-dlp and extractors loaded in {startup_timings['yt_dlp_load']:.2f}s")
+    if STARTUP_PROFILE:
+        print(importtime_summary())
+
+
+def importtime_summary() -> str:
+    """Re-run the heavy imports under `-X importtime` in a child process and summarize them."""
+    cmd = [
+        sys.executable, '-X', 'importtime', '-c',
+        'import telebot, requests, yt_dlp; '
+        'from yt_dlp.extractor import gen_extractor_classes; gen_extractor_classes()',
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    packages: dict[str, int] = {}
+    for line in result.stderr.decode('utf-8', errors='ignore').splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|', 2)
+        # Only top-level entries (no nesting indent) so cumulative times do not double count
+        if name.startswith('  ') or not cumulative.strip().isdigit():
+            continue
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(cumulative)
+
+    lines = ['[startup] -X importtime, cumulative per top-level package:']
+    for package, micros in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:STARTUP_IMPORTTIME_TOP]:
+        lines.append(f"  {micros / 1_000_000:8.3f}s  {package}")
+    return '\n'.join(lines)
+
+
+def _first_get_updates(get_updates):
+    def wrapper(*args, **kwargs):
+        if bot.get_updates is wrapper:
+            # Restore the bound method so later polls skip this wrapper entirely
+            del bot.get_updates
+            startup_timings['first_get_updates'] = time.perf_counter() - STARTED_AT
+            print(
+                f"[startup] module imports {startup_timings['module_loaded']:.2f}s, "
+                f"first getUpdates after {startup_timings['first_get_updates']:.2f}s"
+            )
+            threading.Thread(target=warm_up_yt_dlp, name='yt-dlp-warm-up', daemon=True).start()
+        return get_updates(*args, **kwargs)
+    return wrapper
+
+
+bot.get_updates = _first_get_updates(bot.get_updates)
+
 
 def nextcloud_enabled() -> bool:
     return bool(
@@ -120,36 +237,466 @@ def safe_unlink(path: Optional[Path]) -> None:
     except Exception as exc:
         print(f"Cleanup error: {exc}")
 
-def convert_to_mp4(source: Path) -> Path:
+
+class JobTrace:
+    """
+    Spans and instant events recorded for a single download job.
+
+    Timestamps are microseconds since the job started, which is what the
+    Chrome trace-event format expects, so export is a straight dump.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self.records: list[dict[str, Any]] = []
+
+    def now(self) -> int:
+        return int((time.perf_counter() - self._origin) * 1_000_000)
+
+    def _record(self, record: dict[str, Any]) -> None:
+        record['tid'] = threading.get_ident()
+        with self._lock:
+            self.records.append(record)
+
+    def add_span(self, name: str, start: int, **attrs) -> None:
+        self._record({'name': name, 'ph': 'X', 'ts': start, 'dur': self.now() - start, 'args': attrs})
+
+    def event(self, name: str, **attrs) -> None:
+        self._record({'name': name, 'ph': 'i', 's': 't', 'ts': self.now(), 'args': attrs})
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        start = self.now()
+        try:
+            yield attrs
+        finally:
+            self.add_span(name, start, **attrs)
+
+    def to_chrome(self) -> dict[str, Any]:
+        with self._lock:
+            events = [dict(record, pid=1) for record in self.records]
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': f"job {self.job_id}"}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def to_jsonl(self) -> str:
+        with self._lock:
+            records = list(self.records)
+        lines = []
+        for record in records:
+            lines.append(json.dumps({
+                'job_id': self.job_id,
+                'job_started_at': self.started_at.isoformat(),
+                'name': record['name'],
+                'kind': 'span' if record['ph'] == 'X' else 'event',
+                'start_ms': record['ts'] / 1000,
+                'duration_ms': record['dur'] / 1000 if 'dur' in record else None,
+                'thread': record['tid'],
+                'attrs': record['args'],
+            }, ensure_ascii=False, default=str))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        with self._lock:
+            records = sorted(self.records, key=lambda record: record['ts'])
+
+        lines = [f"Trace for job {self.job_id}", '', 'Spans:']
+        for record in records:
+            if record['ph'] == 'X':
+                lines.append(f"  {record['ts'] / 1000:10.1f} ms  {record['dur'] / 1000:10.1f} ms  {record['name']}")
+
+        # Attribute the gap between consecutive yt-dlp log lines to the earlier line's tag,
+        # which separates extraction, JS challenge solving, fragment retries, merging...
+        phases: dict[str, int] = {}
+        log_events = [record for record in records if record['name'].startswith('yt-dlp [')]
+        for current, following in zip(log_events, log_events[1:]):
+            phases[current['name']] = phases.get(current['name'], 0) + following['ts'] - current['ts']
+        if phases:
+            lines += ['', 'yt-dlp phases:']
+            for name, total in sorted(phases.items(), key=lambda item: item[1], reverse=True):
+                lines.append(f"  {total / 1000:10.1f} ms  {name}")
+        return '\n'.join(lines)
+
+
+_trace_context = threading.local()
+
+
+def current_trace() -> Optional[JobTrace]:
+    return getattr(_trace_context, 'trace', None)
+
+
+def trace_span(name: str, **attrs):
+    trace = current_trace()
+    if trace is None:
+        return nullcontext(attrs)
+    return trace.span(name, **attrs)
+
+
+def run_traced(name: str, cmd: list[str]) -> subprocess.CompletedProcess:
+    with trace_span(name, cmd=cmd[0]) as attrs:
+        result = subprocess.run(cmd, capture_output=True)
+        attrs['returncode'] = result.returncode
+    return result
+
+
+def export_trace(trace: JobTrace) -> None:
+    if not TRACE_DIR:
+        return
+    try:
+        TRACE_DIR.mkdir(parents=True, exist_ok=True)
+        if TRACE_FORMAT == 'chrome':
+            path = TRACE_DIR / f"{trace.job_id}.trace.json"
+            path.write_text(json.dumps(trace.to_chrome(), default=str), encoding='utf-8')
+        else:
+            with (TRACE_DIR / 'traces.jsonl').open('a', encoding='utf-8') as f:
+                f.write(trace.to_jsonl())
+    except OSError as exc:
+        print(f"Trace export failed ({exc})")
+
+
+class YtdlpTraceLogger:
+    """
+    yt-dlp logger that keeps printing like the default one and records every
+    non-progress line as a trace event named after its `[tag]` prefix.
+
+    Progress lines are neither printed nor recorded: with a logger installed
+    yt-dlp sends each update as a separate debug line instead of rewriting
+    one line in place, which would flood the console.
+    """
+
+    TAG_REGEX = re.compile(r'^((?:\[[^\]]+\]\s*)+)')
+
+    def __init__(self, trace: JobTrace):
+        self.trace = trace
+
+    @staticmethod
+    def _is_progress(msg: str) -> bool:
+        return msg.startswith('[download]') and '%' in msg and 'ETA' in msg
+
+    def _record(self, level: str, msg: str) -> None:
+        match = self.TAG_REGEX.match(msg)
+        tag = ' '.join(match.group(1).split()) if match else f"[{level}]"
+        self.trace.event(f"yt-dlp {tag}", level=level, msg=msg[:300])
+
+    def debug(self, msg: str) -> None:
+        if self._is_progress(msg):
+            return
+        print(msg)
+        self._record('debug', msg)
+
+    def info(self, msg: str) -> None:
+        if self._is_progress(msg):
+            return
+        print(msg)
+        self._record('info', msg)
+
+    def warning(self, msg: str) -> None:
+        # yt-dlp only adds the prefix itself when no logger is set
+        print(f"WARNING: {msg}", file=sys.stderr)
+        self._record('warning', msg)
+
+    def error(self, msg: str) -> None:
+        # Errors already arrive as "ERROR: ..."
+        print(msg, file=sys.stderr)
+        self._record('error', msg)
+
+
+# On-demand profiling: /profile N profiles the next N jobs and reports back to the requester.
+# Only one job is profiled at a time, cProfile cannot run two profilers concurrently.
+profile_lock = threading.Lock()
+profile_state: dict[str, Any] = {'remaining': 0, 'chat_id': None, 'active': False, 'tracemalloc_owned': False}
+
+
+def claim_profile_slot() -> Optional[int]:
+    with profile_lock:
+        if profile_state['remaining'] <= 0 or profile_state['active']:
+            return None
+        profile_state['remaining'] -= 1
+        profile_state['active'] = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            profile_state['tracemalloc_owned'] = True
+        return profile_state['chat_id']
+
+
+def release_profile_slot() -> Optional[tracemalloc.Snapshot]:
+    with profile_lock:
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        if profile_state['tracemalloc_owned']:
+            tracemalloc.stop()
+            profile_state['tracemalloc_owned'] = False
+        profile_state['active'] = False
+        return snapshot
+
+
+def build_profile_report(trace: JobTrace, profiler: cProfile.Profile,
+                         snapshot: Optional[tracemalloc.Snapshot]) -> str:
+    out = io.StringIO()
+    out.write(trace.summary())
+    out.write('\n\ncProfile (handler thread, by cumulative time):\n')
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_REPORT_LINES)
+    if snapshot:
+        out.write('\ntracemalloc top allocations:\n')
+        for stat in snapshot.statistics('lineno')[:PROFILE_REPORT_LINES]:
+            out.write(f"  {stat}\n")
+    return out.getvalue()
+
+
+def send_profile_report(chat_id: int, trace: JobTrace, profiler: cProfile.Profile,
+                        snapshot: Optional[tracemalloc.Snapshot]) -> None:
+    report = build_profile_report(trace, profiler, snapshot)
+    try:
+        bot.send_document(
+            chat_id,
+            io.BytesIO(report.encode('utf-8')),
+            visible_file_name=f"profile-{trace.job_id}.txt",
+        )
+        bot.send_document(
+            chat_id,
+            io.BytesIO(json.dumps(trace.to_chrome(), default=str).encode('utf-8')),
+            visible_file_name=f"trace-{trace.job_id}.json",
+        )
+    except Exception as exc:
+        print(f"Sending profile report failed ({exc})")
+
+
+def estimate_filesize(info: dict[str, Any]) -> Optional[int]:
+    formats = info.get('requested_formats') or [info]
+    total = 0
+    for fmt in formats:
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if not size:
+            return None
+        total += size
+    return int(total)
+
+
+# Bytes of RAM-backed scratch space currently promised to small-file jobs
+memory_lock = threading.Lock()
+memory_state = {'reserved': 0}
+
+
+def reserve_memory(estimate: Optional[int]) -> int:
+    """
+    Reserve RAM-backed scratch space for a small job, or return 0 to use disk.
+
+    Falls back to disk when the estimate is unknown or too large, the global
+    cap would be exceeded, or the tmpfs itself (64 MB by default in Docker)
+    has no room left.
+    """
+    if not estimate or not SMALL_FILE_MAX_BYTES or estimate > SMALL_FILE_MAX_BYTES:
+        return 0
+    if not MEMORY_DIR.is_dir():
+        return 0
+
+    needed = estimate * MEMORY_RESERVE_FACTOR
+    with memory_lock:
+        try:
+            free = shutil.disk_usage(MEMORY_DIR).free
+        except OSError:
+            return 0
+        # Space already promised to running jobs may not be written yet, so don't count it as free
+        if memory_state['reserved'] + needed > MEMORY_CAP_BYTES or needed > free - memory_state['reserved']:
+            return 0
+        memory_state['reserved'] += needed
+    return needed
+
+
+def release_memory(amount: int) -> None:
+    if not amount:
+        return
+    with memory_lock:
+        memory_state['reserved'] -= amount
+
+
+def is_disk_full(exc: Optional[BaseException]) -> bool:
+    """Whether `exc`, or anything it wraps (yt-dlp keeps the original in exc_info), is ENOSPC."""
+    seen: set[int] = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, OSError) and exc.errno == errno.ENOSPC:
+            return True
+        if 'No space left on device' in str(exc):
+            return True
+        wrapped = getattr(exc, 'exc_info', None)
+        exc = (wrapped[1] if wrapped else None) or exc.__cause__ or exc.__context__
+    return False
+
+
+FFMPEG_DURATION_REGEX = re.compile(r'Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+FFMPEG_VIDEO_SIZE_REGEX = re.compile(r'Stream #\d+:\d+.*?: Video: .*?, (\d{2,5})x(\d{2,5})\b')
+THUMBNAIL_FILTER = 'thumbnail=25,scale=320:320:force_original_aspect_ratio=decrease'
+
+
+def parse_ffmpeg_metadata(stderr: str) -> dict[str, Any]:
+    """Pull duration from the input section and dimensions from the first output of ffmpeg's log."""
+    metadata: dict[str, Any] = {}
+    input_log, _, output_log = stderr.partition('Output #0')
+
+    match = FFMPEG_DURATION_REGEX.search(input_log)
+    if match:
+        hours, minutes, seconds = match.groups()
+        metadata['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    match = FFMPEG_VIDEO_SIZE_REGEX.search(output_log)
+    if match:
+        metadata['width'], metadata['height'] = int(match.group(1)), int(match.group(2))
+    return metadata
+
+
+def ffmpeg_error(prefix: str, result: subprocess.CompletedProcess) -> Exception:
+    """Exception for a failed ffmpeg run; OSError(ENOSPC) when the output filesystem filled up."""
+    stderr = result.stderr.decode('utf-8', errors='ignore')
+    if 'No space left on device' in stderr:
+        return OSError(errno.ENOSPC, f"{prefix}: {stderr[-400:]}")
+    return RuntimeError(f"{prefix}: {stderr[-400:]}")
+
+
+def convert_to_mp4(source: Path, with_thumbnail: bool = True,
+                   target_dir: Optional[Path] = None) -> tuple[Path, dict[str, Any]]:
     """
     Convert any video file to an iPhone-friendly MP4 (H.264 + AAC).
 
     We ALWAYS re-encode, even if the source is already .mp4,
     because codecs/flags inside might still be incompatible
     with iOS editing (Photos, iMovie, etc.).
+
+    The same ffmpeg run also writes a JPEG thumbnail (only ask for one when
+    the source may have a video stream; if it turns out to have none we
+    rerun without it), and its log gives us duration and output
+    dimensions, so sending the video needs no ffprobe.
+    Returns the converted file and a metadata dict (duration, width,
+    height, thumbnail), any of which may be missing. Output goes next to
+    the source unless `target_dir` is given.
     """
     suffix = source.suffix.lower()
+    target_dir = target_dir or source.parent
 
     # Write to a new file so we never corrupt the original
     if suffix == '.mp4':
-        target = source.with_name(source.stem + '_ios.mp4')
+        target = target_dir / (source.stem + '_ios.mp4')
     else:
-        target = source.with_suffix('.mp4')
+        target = target_dir / (source.stem + '.mp4')
+    thumbnail = target.with_name(target.stem + '_thumb.jpg')
 
     cmd = [
-        'ffmpeg', '-y', '-nostdin', '-loglevel', 'error',
+        'ffmpeg', '-y', '-nostdin', '-hide_banner', '-nostats', '-loglevel', 'info',
         '-i', str(source),
         '-c:v', 'libx264', '-preset', 'veryfast',
         '-c:a', 'aac', '-b:a', '192k',
         '-movflags', '+faststart',
         str(target),
     ]
-    result = subprocess.run(cmd, capture_output=True)
+    thumbnail_args = [
+        '-map', '0:v:0', '-vf', THUMBNAIL_FILTER, '-frames:v', '1', '-q:v', '4',
+        str(thumbnail),
+    ]
+    result = run_traced('ffmpeg convert', cmd + thumbnail_args if with_thumbnail else cmd)
+    if with_thumbnail and result.returncode != 0 and b'matches no streams' in result.stderr:
+        # Unknown vcodec but no video stream after all; ffmpeg stops at stream
+        # mapping before encoding anything, so this retry is cheap
+        with_thumbnail = False
+        result = run_traced('ffmpeg convert', cmd)
     if result.returncode != 0:
-        raise RuntimeError(
-            f"ffmpeg failed: {result.stderr.decode('utf-8', errors='ignore')[:400]}"
-        )
-    return target
+        safe_unlink(thumbnail)
+        raise ffmpeg_error('ffmpeg failed', result)
+
+    metadata = parse_ffmpeg_metadata(result.stderr.decode('utf-8', errors='ignore'))
+    if with_thumbnail and thumbnail.exists():
+        metadata['thumbnail'] = thumbnail
+    return target, metadata
+
+
+def probe_duration(source: Path) -> Optional[float]:
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        str(source),
+    ]
+    result = run_traced('ffprobe duration', cmd)
+    if result.returncode != 0:
+        return None
+    try:
+        return float(result.stdout.decode('utf-8', errors='ignore').strip())
+    except ValueError:
+        return None
+
+
+def split_mp4(source: Path, limit: int, duration: Optional[float] = None,
+              target_dir: Optional[Path] = None) -> list[tuple[Path, Optional[float]]]:
+    """
+    Cut an MP4 into parts that each fit under `limit` bytes.
+
+    Uses ffmpeg's segment muxer with stream copy, so cuts land on keyframes
+    and nothing is re-encoded. Each part gets its own faststart moov atom.
+    If a part still ends up too large (long GOPs, bitrate spikes) we retry
+    with shorter segments. Returns (part, duration) pairs, the durations
+    coming from the muxer's segment list. Parts go next to the source
+    unless `target_dir` is given.
+    """
+    size = source.stat().st_size
+    if size <= limit:
+        return [(source, duration)]
+
+    duration = duration or probe_duration(source)
+    if not duration:
+        raise RuntimeError(f"Cannot split {source.name}: unknown duration")
+
+    segment_time = duration * limit / size * SPLIT_SAFETY_FACTOR
+    # ffmpeg expands printf-style sequences in the output name, so escape any literal '%'
+    target_dir = target_dir or source.parent
+    pattern = target_dir / f"{source.stem.replace('%', '%%')}_part%03d.mp4"
+    segment_list = target_dir / f"{source.stem}_parts.csv"
+
+    for _ in range(SPLIT_MAX_ATTEMPTS):
+        cmd = [
+            'ffmpeg', '-y', '-nostdin', '-loglevel', 'error',
+            '-i', str(source),
+            '-map', '0', '-c', 'copy',
+            '-f', 'segment',
+            '-segment_time', f"{segment_time:.3f}",
+            '-reset_timestamps', '1',
+            '-segment_format', 'mp4',
+            '-segment_format_options', 'movflags=+faststart',
+            '-segment_list', str(segment_list), '-segment_list_type', 'csv',
+            str(pattern),
+        ]
+        result = run_traced('ffmpeg split', cmd)
+        parts = sorted(target_dir.glob(f"{glob.escape(source.stem)}_part[0-9][0-9][0-9].mp4"))
+        durations = _read_segment_list(segment_list)
+        safe_unlink(segment_list)
+        if result.returncode != 0:
+            for part in parts:
+                safe_unlink(part)
+            raise ffmpeg_error('ffmpeg split failed', result)
+
+        largest = max((part.stat().st_size for part in parts), default=0)
+        if parts and largest <= limit:
+            return [(part, durations.get(part.name)) for part in parts]
+
+        for part in parts:
+            safe_unlink(part)
+        if largest:
+            segment_time *= limit / largest * SPLIT_SAFETY_FACTOR
+        else:
+            segment_time /= 2
+
+    raise RuntimeError(f"Could not split {source.name} into parts under {limit} bytes")
+
+
+def _read_segment_list(path: Path) -> dict[str, float]:
+    durations: dict[str, float] = {}
+    try:
+        with path.open(newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) >= 3:
+                    durations[Path(row[0]).name] = float(row[2]) - float(row[1])
+    except (OSError, ValueError):
+        pass
+    return durations
 
 
 def _ensure_webdav_dirs(session: requests.Session, remote_path: str) -> None:
@@ -309,7 +856,35 @@ def download_video(message, url, audio: bool = False, format_id: str = "bestvide
     msg = bot.reply_to(message, 'Downloading...')
     progress_key = f"{message.chat.id}-{msg.message_id}"
 
+    trace = JobTrace(progress_key)
+    last_traced = {'downloading': 0.0}
+
+    def trace_progress(d):
+        status = d.get('status')
+        now = time.monotonic()
+        if status == 'downloading' and now - last_traced['downloading'] < PROGRESS_TRACE_INTERVAL:
+            return
+        last_traced['downloading'] = now
+        trace.event(
+            f"yt-dlp progress {status}",
+            downloaded_bytes=d.get('downloaded_bytes'),
+            total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+            fragment_index=d.get('fragment_index'),
+            fragment_count=d.get('fragment_count'),
+            speed=d.get('speed'),
+        )
+
+    postprocessor_started: dict[str, int] = {}
+
+    def trace_postprocessor(d):
+        name = f"yt-dlp postprocessor {d.get('postprocessor')}"
+        if d.get('status') == 'started':
+            postprocessor_started[name] = trace.now()
+        elif d.get('status') == 'finished' and name in postprocessor_started:
+            trace.add_span(name, postprocessor_started.pop(name))
+
     def progress(d):
+        trace_progress(d)
         if d.get('status') != 'downloading':
             return
         try:
@@ -346,8 +921,10 @@ def download_video(message, url, audio: bool = False, format_id: str = "bestvide
 
     ydl_opts: dict[str, Any] = {
         'format': format_id,
-        'outtmpl': str(output_dir / '%(title).95B-%(id)s.%(ext)s'),
+        'outtmpl': '%(title).95B-%(id)s.%(ext)s',
+        'paths': {'home': str(output_dir)},
         'progress_hooks': [progress],
+        'postprocessor_hooks': [trace_postprocessor],
         'retries': YTDLP_RETRIES,
         'fragment_retries': YTDLP_FRAGMENT_RETRIES,
         'continuedl': True,
@@ -417,10 +994,62 @@ def download_video(message, url, audio: bool = False, format_id: str = "bestvide
 
     downloaded_file: Optional[Path] = None
     final_file: Optional[Path] = None
+    parts: list[tuple[Path, Optional[float]]] = []
+    metadata: dict[str, Any] = {}
+    scratch_dir: Optional[Path] = None
+    memory_reserved = 0
+
+    try:
+        with trace.span('yt-dlp load wait'):
+            yt_dlp = load_yt_dlp()
+    except Exception as e:
+        # Handled here rather than in the main try, whose except clauses need yt_dlp
+        print(f"yt-dlp load error: {e}")
+        bot.edit_message_text('The downloader failed to load, please try again later.', message.chat.id, msg.message_id)
+        return
+
+    def on_disk_if_full(step, *args):
+        try:
+            return step(*args)
+        except OSError as exc:
+            if not scratch_dir or exc.errno != errno.ENOSPC:
+                raise
+            # The re-encode outgrew the RAM reservation; keep the input in RAM, write this step to disk
+            return step(*args, target_dir=output_dir)
+
+    profile_chat_id = claim_profile_slot()
+    profiler = cProfile.Profile() if profile_chat_id is not None else None
+    if TRACE_DIR or profiler:
+        # Only swap out yt-dlp's own console output when someone will read the trace
+        ydl_opts['logger'] = YtdlpTraceLogger(trace)
+    _trace_context.trace = trace
+    job_started = trace.now()
+    if profiler:
+        profiler.enable()
 
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:  # type: ignore[arg-type]
-            info = ydl.extract_info(url, download=True)
+            with trace_span('yt-dlp extract', url=url, format=ydl_opts['format']):
+                info = ydl.extract_info(url, download=False)
+
+            # Small jobs go to a RAM-backed scratch dir instead of output_folder
+            memory_reserved = reserve_memory(estimate_filesize(info))
+            if memory_reserved:
+                scratch_dir = Path(tempfile.mkdtemp(prefix='dl-telegram-', dir=MEMORY_DIR))
+                ydl.params['paths'] = {'home': str(scratch_dir)}
+
+            with trace_span('yt-dlp download', in_memory=bool(scratch_dir)):
+                try:
+                    info = ydl.process_ie_result(info, download=True)
+                except yt_dlp.utils.DownloadError as exc:
+                    if not scratch_dir or not is_disk_full(exc):
+                        raise
+                    # The estimate was off and the tmpfs filled up, retry on disk
+                    shutil.rmtree(scratch_dir, ignore_errors=True)
+                    release_memory(memory_reserved)
+                    scratch_dir, memory_reserved = None, 0
+                    ydl.params['paths'] = {'home': str(output_dir)}
+                    info = ydl.process_ie_result(info, download=True)
 
             # Figure out which file yt-dlp wrote
             requested = info.get('requested_downloads') or []
@@ -443,34 +1072,105 @@ def download_video(message, url, audio: bool = False, format_id: str = "bestvide
                     message_id=msg.message_id,
                     text='Processing file with ffmpeg...',
                 )
-                final_file = convert_to_mp4(downloaded_file)
+                has_video = info.get('vcodec') != 'none'
+                final_file, metadata = on_disk_if_full(convert_to_mp4, downloaded_file, has_video)
+                # Fall back to what the extractor reported if ffmpeg's log lacked it
+                duration = metadata.get('duration') or info.get('duration')
+
+                if final_file.stat().st_size > TELEGRAM_UPLOAD_LIMIT:
+                    bot.edit_message_text(
+                        chat_id=message.chat.id,
+                        message_id=msg.message_id,
+                        text='File is too large for Telegram, splitting into parts...',
+                    )
+                    parts = on_disk_if_full(split_mp4, final_file, TELEGRAM_UPLOAD_LIMIT, duration)
+                else:
+                    parts = [(final_file, duration)]
 
             # Send to Telegram
-            with final_file.open('rb') as f:
-                if audio:
+            if audio:
+                with final_file.open('rb') as f, trace_span('telegram upload', bytes=final_file.stat().st_size):
                     bot.send_audio(
                         message.chat.id,
                         f,
                         reply_to_message_id=message.message_id,
                     )
+            else:
+                width = metadata.get('width') or info.get('width')
+                height = metadata.get('height') or info.get('height')
+                if not (width and height) and requested:
+                    width = width or requested[0].get('width')
+                    height = height or requested[0].get('height')
+                thumbnail: Optional[Path] = metadata.get('thumbnail')
+
+                def send_part(index: int, part: Path, part_duration: Optional[float]) -> None:
+                    caption = f"Part {index}/{len(parts)}" if len(parts) > 1 else None
+                    # Runs in upload pool threads, so use the trace directly rather than the thread-local
+                    with part.open('rb') as f, trace.span('telegram upload', part=index, bytes=part.stat().st_size) as attrs:
+                        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+                            attrs['attempts'] = attempt
+                            f.seek(0)
+                            thumb = thumbnail.open('rb') if thumbnail else None
+                            try:
+                                bot.send_video(
+                                    message.chat.id,
+                                    f,
+                                    reply_to_message_id=message.message_id,
+                                    duration=round(part_duration) if part_duration else None,
+                                    width=width,
+                                    height=height,
+                                    thumbnail=thumb,
+                                    caption=caption,
+                                    supports_streaming=True,
+                                )
+                                return
+                            except ApiTelegramException as exc:
+                                retry_after = _retry_after(exc)
+                                if retry_after is None or attempt == UPLOAD_ATTEMPTS:
+                                    raise
+                                # Parallel parts to one chat hit flood limits, wait as told and resend
+                                time.sleep(retry_after)
+                            finally:
+                                if thumb:
+                                    thumb.close()
+
+                if len(parts) == 1:
+                    send_part(1, *parts[0])
                 else:
-                    width = info.get('width')
-                    height = info.get('height')
-                    if not (width and height) and requested:
-                        width = width or requested[0].get('width')
-                        height = height or requested[0].get('height')
-
-                    bot.send_video(
-                        message.chat.id,
-                        f,
-                        reply_to_message_id=message.message_id,
-                        width=width,
-                        height=height,
+                    bot.edit_message_text(
+                        chat_id=message.chat.id,
+                        message_id=msg.message_id,
+                        text=f"Uploading {len(parts)} parts...",
                     )
+                    with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(parts))) as pool:
+                        futures = [
+                            pool.submit(send_part, index, part, part_duration)
+                            for index, (part, part_duration) in enumerate(parts, start=1)
+                        ]
+                    failed = {
+                        index: future.exception()
+                        for index, future in enumerate(futures, start=1)
+                        if future.exception()
+                    }
+                    if failed and len(failed) == len(parts):
+                        raise next(iter(failed.values()))
+                    if failed:
+                        sent = [str(index) for index in range(1, len(parts) + 1) if index not in failed]
+                        print(f"Upload error: {failed}")
+                        bot.edit_message_text(
+                            chat_id=message.chat.id,
+                            message_id=msg.message_id,
+                            text=(
+                                f"Sent parts {', '.join(sent)} of {len(parts)}. "
+                                f"Parts {', '.join(str(index) for index in failed)} failed to upload, "
+                                f"please try again later."
+                            ),
+                        )
+                        return
 
             bot.delete_message(message.chat.id, msg.message_id)
 
-    except DownloadError:
+    except yt_dlp.utils.DownloadError:
         bot.edit_message_text('Invalid URL or download error', message.chat.id, msg.message_id)
     except Exception as e:
         print(f"Download/Send error: {e}")
@@ -481,35 +1181,199 @@ def download_video(message, url, audio: bool = False, format_id: str = "bestvide
             parse_mode="MARKDOWN",
         )
     finally:
+        if profiler:
+            profiler.disable()
+        trace.add_span('job', job_started, audio=audio)
+        _trace_context.trace = None
+        export_trace(trace)
+        if profiler:
+            send_profile_report(profile_chat_id, trace, profiler, release_profile_slot())
+
         if progress_key in last_edited:
             del last_edited[progress_key]
 
         safe_unlink(downloaded_file if downloaded_file and downloaded_file != final_file else None)
         safe_unlink(final_file if final_file and final_file != downloaded_file else None)
+        for part, _ in parts:
+            if part != final_file:
+                safe_unlink(part)
+        safe_unlink(metadata.get('thumbnail'))
+        if scratch_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        release_memory(memory_reserved)
 
 
 
-def log(message, text: str, media: str):
-    if not config.logs:
-        return
+class LogDispatcher:
+    """
+    Background sink for download audit records.
 
-    if message.chat.type == 'private':
+    Handlers only enqueue; a daemon thread batches whatever arrived during
+    `interval` into as few logs-chat messages as possible, backs off on
+    Telegram flood limits and optionally appends each record to a JSONL file.
+    When the queue is full records are dropped and counted instead of
+    blocking the download.
+    """
+
+    def __init__(self, chat_id, jsonl_path: Optional[str], interval: float, maxsize: int):
+        self.chat_id = chat_id
+        self.jsonl_path = Path(jsonl_path) if jsonl_path else None
+        self.interval = interval
+        self.records: queue.Queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.chat_id or self.jsonl_path)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='log-dispatcher', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def submit(self, record: dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        self.start()
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _drain(self) -> list[dict[str, Any]]:
+        batch = []
+        while True:
+            try:
+                batch.append(self.records.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self) -> None:
+        batch = self._drain()
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if not batch and not dropped:
+            return
+
+        if dropped:
+            print(f"{dropped} log record(s) dropped, queue was full")
+        if self.jsonl_path:
+            if dropped:
+                batch = batch + [{
+                    'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    'dropped': dropped,
+                }]
+            self._write_jsonl(batch)
+        if self.chat_id:
+            entries = [format_log_record(record) for record in batch]
+            if dropped:
+                entries.append(f"{dropped} log record(s) dropped, queue was full")
+            for chunk in _chunk_entries(entries, TELEGRAM_MESSAGE_LIMIT):
+                self._send(chunk)
+
+    def _write_jsonl(self, batch: list[dict[str, Any]]) -> None:
+        try:
+            self.jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.jsonl_path.open('a', encoding='utf-8') as f:
+                for record in batch:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as exc:
+            print(f"Logging to {self.jsonl_path} failed ({exc})")
+
+    def _send(self, text: str) -> None:
+        for _ in range(LOG_SEND_ATTEMPTS):
+            try:
+                bot.send_message(self.chat_id, text)
+                return
+            except ApiTelegramException as exc:
+                retry_after = _retry_after(exc)
+                if retry_after is None:
+                    # Log but do not crash if the logging chat is invalid or unreachable
+                    print(f"Logging failed ({exc})")
+                    return
+                # Flood limited: wait it out, unless we are shutting down
+                if self._stop.wait(retry_after):
+                    break
+            except Exception as exc:
+                print(f"Logging failed ({exc})")
+                return
+        print("Logging failed (flood limit), batch discarded")
+
+
+def _retry_after(exc: ApiTelegramException) -> Optional[int]:
+    if exc.error_code != 429:
+        return None
+    parameters = (exc.result_json or {}).get('parameters') or {}
+    return int(parameters.get('retry_after') or 1)
+
+
+def _chunk_entries(entries: list[str], limit: int) -> list[str]:
+    chunks: list[str] = []
+    current = ''
+    for entry in entries:
+        entry = entry[:limit]
+        candidate = f"{current}\n\n---\n\n{entry}" if current else entry
+        if len(candidate) > limit:
+            chunks.append(current)
+            candidate = entry
+        current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def format_log_record(record: dict[str, Any]) -> str:
+    if record['chat_type'] == 'private':
         chat_info = "Private chat"
     else:
-        chat_title = message.chat.title or 'Unknown group'
-        chat_info = f"Group: *{chat_title}* (`{message.chat.id}`)"
+        chat_title = record['chat_title'] or 'Unknown group'
+        chat_info = f"Group: *{chat_title}* (`{record['chat_id']}`)"
 
-    username = message.from_user.username or 'unknown'
-    payload = (
-        f"Download request ({media}) from @{username} ({message.from_user.id})"
-        f"\n\n{chat_info}\n\n{text}"
+    username = record['username'] or 'unknown'
+    return (
+        f"Download request ({record['media']}) from @{username} ({record['user_id']})"
+        f"\n\n{chat_info}\n\n{record['text']}"
     )
 
-    try:
-        bot.send_message(config.logs, payload)
-    except ApiTelegramException as exc:
-        # Log but do not crash if the logging chat is invalid or unreachable
-        print(f"Logging failed ({exc})")
+
+log_dispatcher = LogDispatcher(config.logs, LOG_JSONL_PATH, LOG_BATCH_INTERVAL, LOG_QUEUE_SIZE)
+atexit.register(log_dispatcher.stop)
+
+
+def handle_sigterm(signum, frame):
+    # `docker stop` sends SIGTERM to PID 1, which skips atexit; flush queued audit records first
+    log_dispatcher.stop()
+    sys.exit(0)
+
+
+def log(message, text: str, media: str):
+    log_dispatcher.submit({
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'media': media,
+        'text': text,
+        'user_id': message.from_user.id,
+        'username': message.from_user.username,
+        'chat_id': message.chat.id,
+        'chat_type': message.chat.type,
+        'chat_title': message.chat.title,
+    })
 
 
 def get_text(message):
@@ -585,6 +1449,33 @@ def login_command(message):
     bot.reply_to(message, 'Cookies saved. Try your members-only download again.')
 
 
+@bot.message_handler(commands=['profile'])
+def profile_command(message):
+    # Reports contain other users' URLs and titles, so this needs an explicit admin list
+    user_id = getattr(getattr(message, 'from_user', None), 'id', None)
+    if not ADMIN_IDS or user_id not in ADMIN_IDS:
+        bot.reply_to(message, 'Only admins listed in BOT_ADMIN_IDS can use /profile.')
+        return
+
+    text = get_text(message) or '1'
+    try:
+        count = int(text)
+    except ValueError:
+        bot.reply_to(
+            message, 'Invalid usage, use `/profile <number of jobs>`', parse_mode="MARKDOWN")
+        return
+
+    with profile_lock:
+        profile_state['remaining'] = max(0, count)
+        # Always report to the admin's private chat, never to a group the command was sent in
+        profile_state['chat_id'] = user_id
+
+    if count > 0:
+        bot.reply_to(message, f"Profiling the next {count} job(s), reports will be sent to you privately.")
+    else:
+        bot.reply_to(message, 'Profiling disabled.')
+
+
 @bot.message_handler(commands=['download'])
 def download_command(message):
     if not ensure_authorized(message):
@@ -628,7 +1519,7 @@ def custom(message):
 
     msg = bot.reply_to(message, 'Getting formats...')
 
-    with yt_dlp.YoutubeDL() as ydl:
+    with load_yt_dlp().YoutubeDL() as ydl:
         info = ydl.extract_info(text, download=False)
 
     formats = info.get('formats') or []
@@ -678,6 +1569,7 @@ def handle_private_messages(message):
 
 if __name__ == '__main__':
     import traceback
+    signal.signal(signal.SIGTERM, handle_sigterm)
     while True:
         try:
             bot.infinity_polling(timeout=20, long_polling_timeout=20)
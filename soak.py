@@ -0,0 +1,424 @@
+"""Soak/load harness: runs the real bot handlers for a long time and watches resource growth.
+
+A local stub Bot API feeds download requests through getUpdates at a fixed
+rate (so telebot's polling and worker pool are exercised exactly as in
+production) and a local media server serves a test clip. While jobs run we
+sample RSS, open file descriptors, thread count, disk and RAM scratch usage,
+small-file reservations and tracemalloc top allocations. At the end the
+growth per 1,000 jobs is estimated with a least-squares fit and the run
+fails if it exceeds the configured thresholds.
+
+Needs ffmpeg on PATH (to build the test clip and for the bot's conversion).
+
+    python soak.py --duration 3600 --rate 0.5
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlparse
+
+SOAK_CHAT_ID = 424242
+SOAK_USER_ID = 4242
+SOAK_LOGS_CHAT_ID = -100424242  # audit batches from the log dispatcher land here
+WARMUP_FRACTION = 0.1  # samples ignored when fitting growth, lets caches and pools fill first
+
+
+class StubBotApi:
+    """Minimal Bot API: hands out queued updates and acknowledges everything else."""
+
+    def __init__(self):
+        self.updates: list[dict[str, Any]] = []
+        self.cond = threading.Condition()
+        self.counts: dict[str, int] = {}
+        self.next_update_id = itertools.count(1)
+        self.next_message_id = itertools.count(1)
+        self.failed_jobs = 0
+        self.finished_jobs = 0
+
+    def enqueue(self, text: str) -> None:
+        update_id = next(self.next_update_id)
+        with self.cond:
+            self.updates.append({
+                'update_id': update_id,
+                'message': {
+                    'message_id': next(self.next_message_id),
+                    'date': int(time.time()),
+                    'chat': {'id': SOAK_CHAT_ID, 'type': 'private'},
+                    'from': {'id': SOAK_USER_ID, 'is_bot': False, 'first_name': 'soak', 'username': 'soak'},
+                    'text': text,
+                },
+            })
+            self.cond.notify_all()
+
+    def get_updates(self, params: dict[str, str]) -> list[dict[str, Any]]:
+        offset = int(params.get('offset') or 0)
+        timeout = min(float(params.get('timeout') or 0), 1.0)
+        with self.cond:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            if not self.updates and timeout:
+                self.cond.wait(timeout)
+            return list(self.updates)
+
+    def handle(self, method: str, params: dict[str, str]) -> Any:
+        with self.cond:
+            self.counts[method] = self.counts.get(method, 0) + 1
+            if method in ('sendVideo', 'sendAudio'):
+                self.finished_jobs += 1
+            elif method == 'editMessageText' and params.get('text', '').startswith(('There was an error', 'Invalid URL')):
+                self.failed_jobs += 1
+
+        if method == 'getUpdates':
+            return self.get_updates(params)
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'soak', 'username': 'soak_bot'}
+        if method in ('deleteMessage', 'deleteWebhook', 'answerCallbackQuery'):
+            return True
+        return {
+            'message_id': next(self.next_message_id),
+            'date': int(time.time()),
+            'chat': {'id': SOAK_CHAT_ID, 'type': 'private'},
+            'text': params.get('text', ''),
+        }
+
+    @property
+    def jobs_done(self) -> int:
+        with self.cond:
+            return self.finished_jobs + self.failed_jobs
+
+
+def make_bot_api_handler(api: StubBotApi):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self._dispatch()
+
+        def do_GET(self):
+            self._dispatch()
+
+        def _dispatch(self):
+            parsed = urlparse(self.path)
+            method = parsed.path.rstrip('/').rsplit('/', 1)[-1]
+            params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                params.update({key: values[-1] for key, values in parse_qs(body.decode('utf-8', 'ignore')).items()})
+
+            payload = json.dumps({'ok': True, 'result': api.handle(method, params)}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def make_media_handler(media: Path):
+    class Handler(BaseHTTPRequestHandler):
+        # Every /clip-<n>.mp4 path serves the same file, so concurrent jobs get distinct yt-dlp ids
+        def do_HEAD(self):
+            self._serve(body=False)
+
+        def do_GET(self):
+            self._serve(body=True)
+
+        def _serve(self, body: bool):
+            if not urlparse(self.path).path.endswith('.mp4'):
+                self.send_error(404)
+                return
+            data = media.read_bytes()
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if body:
+                self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_server(handler) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"stub-{handler.__name__}", daemon=True).start()
+    return server
+
+
+def build_test_clip(target: Path, seconds: int) -> None:
+    cmd = [
+        'ffmpeg', '-y', '-nostdin', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f"testsrc=duration={seconds}:size=640x360:rate=30",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:duration={seconds}",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'aac', '-shortest',
+        '-movflags', '+faststart',
+        str(target),
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode('utf-8', errors='ignore')[:400]}")
+
+
+def read_rss_bytes() -> int:
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    # ru_maxrss is a peak, not current, but it is the best we have off Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def count_open_fds() -> Optional[int]:
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return None
+
+
+def directory_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += (Path(root) / name).stat().st_size
+            except OSError:
+                continue
+    return total
+
+
+def take_sample(main, api: StubBotApi, started: float, top: int) -> dict[str, Any]:
+    sample: dict[str, Any] = {
+        'elapsed': round(time.monotonic() - started, 1),
+        'jobs_done': api.jobs_done,
+        'jobs_failed': api.failed_jobs,
+        'rss_bytes': read_rss_bytes(),
+        'open_fds': count_open_fds(),
+        'threads': threading.active_count(),
+        'disk_bytes': directory_size(Path(main.config.output_folder)),
+        'last_edited_entries': len(main.last_edited),
+        'memory_reserved_bytes': main.memory_state['reserved'],
+        'scratch_bytes': directory_size(main.MEMORY_DIR),
+        'scratch_dirs': len(list(main.MEMORY_DIR.glob('dl-telegram-*'))),
+    }
+    if tracemalloc.is_tracing():
+        sample['tracemalloc_current_bytes'] = tracemalloc.get_traced_memory()[0]
+        snapshot = tracemalloc.take_snapshot()
+        sample['tracemalloc_top'] = [str(stat) for stat in snapshot.statistics('lineno')[:top]]
+    return sample
+
+
+def growth_per_1k(samples: list[dict[str, Any]], key: str) -> Optional[float]:
+    points = [(s['jobs_done'], s[key]) for s in samples if s.get(key) is not None]
+    if len(points) < 3:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var_x:
+        return None
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+    return slope * 1000
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=3600, help='seconds to keep submitting jobs')
+    parser.add_argument('--rate', type=float, default=0.5, help='jobs submitted per second')
+    parser.add_argument('--audio-ratio', type=float, default=0.0, help='fraction of jobs sent as /audio')
+    parser.add_argument('--media', type=Path, help='clip to serve (default: generated with ffmpeg)')
+    parser.add_argument('--clip-seconds', type=int, default=5, help='length of the generated clip')
+    parser.add_argument('--memory-dir', type=Path,
+                        help='RAM scratch dir for small jobs (default: a fresh dir under /dev/shm)')
+    parser.add_argument('--disk-only', action='store_true',
+                        help="don't feed the clip size to the small-file estimate, so jobs take the disk path")
+    parser.add_argument('--keep-workdir', action='store_true',
+                        help='keep the temp dir with the generated clip and downloads after the run')
+    parser.add_argument('--sample-interval', type=float, default=10, help='seconds between samples')
+    parser.add_argument('--drain-timeout', type=float, default=300, help='seconds to wait for queued jobs at the end')
+    parser.add_argument('--samples-file', type=Path, help='write samples as JSONL here')
+    parser.add_argument('--tracemalloc-frames', type=int, default=1, help='0 disables tracemalloc')
+    parser.add_argument('--tracemalloc-top', type=int, default=10)
+    parser.add_argument('--max-rss-mb', type=float, default=50, help='allowed RSS growth per 1,000 jobs')
+    parser.add_argument('--max-fds', type=float, default=10, help='allowed open FD growth per 1,000 jobs')
+    parser.add_argument('--max-threads', type=float, default=5, help='allowed thread growth per 1,000 jobs')
+    parser.add_argument('--max-disk-mb', type=float, default=10,
+                        help='allowed output folder and RAM scratch growth per 1,000 jobs')
+    parser.add_argument('--max-scratch-dirs', type=float, default=1,
+                        help='allowed growth in leftover RAM scratch dirs per 1,000 jobs')
+    return parser.parse_args(argv)
+
+
+def run(args: argparse.Namespace) -> int:
+    workdir = Path(tempfile.mkdtemp(prefix='dl-telegram-soak-'))
+    try:
+        return soak(args, workdir)
+    finally:
+        if args.keep_workdir:
+            print(f"[soak] kept work dir {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def soak(args: argparse.Namespace, workdir: Path) -> int:
+    os.environ.setdefault('BOT_TOKEN', '123456:SOAK')
+    os.environ['BOT_OUTPUT_FOLDER'] = str(workdir / 'downloads')
+    os.environ['BOT_ADMIN_IDS'] = ''
+    os.environ['BOT_LOGS_CHAT_ID'] = str(SOAK_LOGS_CHAT_ID)
+    os.environ.setdefault('BOT_YTDLP_VERBOSE', '0')
+    memory_dir = args.memory_dir
+    owns_memory_dir = memory_dir is None
+    if owns_memory_dir:
+        shm = Path('/dev/shm')
+        memory_dir = Path(tempfile.mkdtemp(prefix='soak-', dir=shm if shm.is_dir() else workdir))
+    os.environ['BOT_MEMORY_DIR'] = str(memory_dir)
+
+    media = args.media
+    if not media:
+        media = workdir / 'clip.mp4'
+        build_test_clip(media, args.clip_seconds)
+
+    api = StubBotApi()
+    api_server = start_server(make_bot_api_handler(api))
+    media_server = start_server(make_media_handler(media))
+    media_base = f"http://127.0.0.1:{media_server.server_address[1]}"
+
+    if args.tracemalloc_frames:
+        tracemalloc.start(args.tracemalloc_frames)
+
+    import main
+    from telebot import apihelper
+    apihelper.API_URL = f"http://127.0.0.1:{api_server.server_address[1]}/bot{{0}}/{{1}}"
+
+    if not args.disk_only:
+        # The generic extractor reports no filesize for a direct .mp4, which would send every
+        # job to disk; supply the clip size so the RAM scratch path and its reservations run
+        media_size = media.stat().st_size
+        estimate_filesize = main.estimate_filesize
+        main.estimate_filesize = lambda info: estimate_filesize(info) or media_size
+
+    polling = threading.Thread(
+        target=main.bot.infinity_polling,
+        kwargs={'timeout': 20, 'long_polling_timeout': 1},
+        name='soak-polling',
+        daemon=True,
+    )
+    polling.start()
+
+    samples: list[dict[str, Any]] = []
+    samples_file = args.samples_file.open('w', encoding='utf-8') if args.samples_file else None
+    started = time.monotonic()
+    next_job = started
+    submitted = 0
+    rng = random.Random(0)
+    deadline = started + args.duration
+
+    sampling_done = threading.Event()
+
+    def record_sample():
+        sample = take_sample(main, api, started, args.tracemalloc_top)
+        samples.append(sample)
+        print(
+            f"[soak] t={sample['elapsed']}s jobs={sample['jobs_done']}/{submitted} "
+            f"failed={sample['jobs_failed']} rss={sample['rss_bytes'] / 1e6:.1f}MB "
+            f"fds={sample['open_fds']} threads={sample['threads']} disk={sample['disk_bytes'] / 1e6:.1f}MB "
+            f"scratch={sample['scratch_bytes'] / 1e6:.1f}MB/{sample['scratch_dirs']} dirs "
+            f"reserved={sample['memory_reserved_bytes'] / 1e6:.1f}MB"
+        )
+        if samples_file:
+            samples_file.write(json.dumps(sample) + '\n')
+            samples_file.flush()
+
+    def sample_loop():
+        # tracemalloc snapshots can take seconds, so they must not hold up job submission
+        while not sampling_done.wait(args.sample_interval):
+            record_sample()
+
+    sampler = threading.Thread(target=sample_loop, name='soak-sampler', daemon=True)
+    record_sample()
+    sampler.start()
+
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= deadline and (api.jobs_done >= submitted or now >= deadline + args.drain_timeout):
+                break
+            if now < deadline and now >= next_job:
+                command = '/audio ' if rng.random() < args.audio_ratio else ''
+                api.enqueue(f"{command}{media_base}/clip-{submitted}.mp4")
+                submitted += 1
+                next_job += 1 / args.rate
+            time.sleep(0.05)
+        sampling_done.set()
+        sampler.join()
+        record_sample()
+    finally:
+        sampling_done.set()
+        main.bot.stop_polling()
+        api_server.shutdown()
+        media_server.shutdown()
+        if samples_file:
+            samples_file.close()
+        if owns_memory_dir:
+            shutil.rmtree(memory_dir, ignore_errors=True)
+
+    steady = samples[int(len(samples) * WARMUP_FRACTION):]
+    checks = [
+        ('rss_bytes', args.max_rss_mb * 1e6, 'RSS', 1e6, 'MB'),
+        ('open_fds', args.max_fds, 'open FDs', 1, ''),
+        ('threads', args.max_threads, 'threads', 1, ''),
+        ('disk_bytes', args.max_disk_mb * 1e6, 'disk usage', 1e6, 'MB'),
+        ('scratch_bytes', args.max_disk_mb * 1e6, 'RAM scratch usage', 1e6, 'MB'),
+        ('scratch_dirs', args.max_scratch_dirs, 'RAM scratch dirs', 1, ''),
+        ('memory_reserved_bytes', args.max_disk_mb * 1e6, 'RAM reservations', 1e6, 'MB'),
+    ]
+
+    print(f"\n[soak] {api.jobs_done} jobs done ({api.failed_jobs} failed) of {submitted} submitted")
+    print(f"[soak] Bot API calls: {api.counts}")
+    failed = False
+    for key, limit, label, scale, unit in checks:
+        growth = growth_per_1k(steady, key)
+        if growth is None:
+            print(f"[soak] {label}: not enough data")
+            continue
+        verdict = 'FAIL' if growth > limit else 'ok'
+        failed = failed or growth > limit
+        print(f"[soak] {label}: {growth / scale:+.2f}{unit} per 1,000 jobs (limit {limit / scale:g}{unit}) {verdict}")
+
+    if samples and samples[-1].get('tracemalloc_top'):
+        print('\n[soak] tracemalloc top allocations at the end:')
+        for line in samples[-1]['tracemalloc_top']:
+            print(f"  {line}")
+
+    if api.jobs_done < submitted:
+        print(f"[soak] {submitted - api.jobs_done} job(s) never finished")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args()))